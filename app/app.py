@@ -1,11 +1,55 @@
-from flask import Flask, render_template
-from model.database import close_db
+import atexit
+import logging
+import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from flask import Flask, Response, render_template, request, url_for
+from flask.logging import default_handler
+from jinja2 import FileSystemBytecodeCache
+from model.database import close_db, commit_db, discard_db, get_query_count
 from model.products_table import ProductsTable
 from model.categories_table import CategoriesTable
 from model.customers_table import CustomersTable
 
 
 app = Flask(__name__)
+app.jinja_options = {"cache_size": 400}
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+if not app.debug:
+    # Template changes are picked up in debug mode only
+    app.jinja_env.auto_reload = False
+
+# Log records are written to the log file by a background thread
+os.makedirs(app.instance_path, exist_ok=True)
+log_queue = queue.Queue()
+log_file_handler = logging.FileHandler(os.path.join(app.instance_path, "bakery.log"))
+log_file_handler.setFormatter(
+    logging.Formatter("[%(asctime)s] %(levelname)s in %(module)s: %(message)s")
+)
+log_listener = QueueListener(log_queue, log_file_handler)
+log_listener.start()
+atexit.register(log_listener.stop)
+app.logger.addHandler(QueueHandler(log_queue))
+if not app.debug:
+    # Flask's stderr handler writes on the request thread
+    app.logger.removeHandler(default_handler)
+
+CUSTOMERS_PER_PAGE = 50
+MAX_CUSTOMERS_PER_PAGE = 200
+
+# Maximum number of SQL statements per request, checked in debug mode
+QUERY_BUDGETS = {
+    "/product": 2,
+    "/product.json": 2,
+    "/category": 2,
+    "/customer": 2,
+}
+
+# The list templates are compiled once at start-up and rendered directly.
+# get_template() returns the cached templates, and in debug mode reloads
+# templates that have changed.
+for name in ("product_list.jinja", "categories.jinja", "customers.jinja"):
+    app.jinja_env.get_template(name)
 
 
 @app.errorhandler(404)
@@ -40,7 +84,19 @@ def product_list():
         Response: the product page
     """
     products = ProductsTable.get()
-    return render_template("product_list.jinja", products=products)
+    template = app.jinja_env.get_template("product_list.jinja")
+    return template.render(products=products)
+
+
+@app.route("/product.json")
+def product_list_json():
+    """Returns all products as JSON
+
+    Returns:
+        Response: a JSON array of all products
+    """
+    products = ProductsTable.get_json()
+    return Response(products, mimetype="application/json")
 
 
 @app.route("/category")
@@ -51,18 +107,41 @@ def category_list():
         Response: the category page
     """
     categories = CategoriesTable.get()
-    return render_template("categories.jinja", categories=categories)
+    template = app.jinja_env.get_template("categories.jinja")
+    return template.render(categories=categories)
 
 
 @app.route("/customer")
 def customer_list():
-    """Returns a page listing all customers
+    """Returns a page listing customers
+
+        The page starts after the customer given by the query parameters
+        "after" (last name) and "after_id" and shows at most "limit"
+        customers.
 
     Returns:
         Response: the customer page
     """
-    customers = CustomersTable.get()
-    return render_template("customers.jinja", customers=customers)
+    limit = request.args.get("limit", CUSTOMERS_PER_PAGE, type=int)
+    limit = min(max(limit, 1), MAX_CUSTOMERS_PER_PAGE)
+    # One extra row tells whether there is a next page
+    customers = CustomersTable.get(
+        limit + 1,
+        request.args.get("after"),
+        request.args.get("after_id", type=int),
+    )
+    next_page = None
+    if len(customers) > limit:
+        customers = customers[:limit]
+        last = customers[-1]
+        next_page = url_for(
+            "customer_list",
+            after=last["LastName"],
+            after_id=last["CustomerID"],
+            limit=limit,
+        )
+    template = app.jinja_env.get_template("customers.jinja")
+    return template.render(customers=customers, next_page=next_page)
 
 
 @app.route("/order")
@@ -76,15 +155,66 @@ def orders():
     return render_template("orders.jinja")
 
 
+# after_request hooks run in reverse order, so the commit happens after
+# check_query_budget() has passed
+@app.after_request
+def commit_transaction(response):
+    """Commits the database transaction of a successful request
+
+        The commit happens before the response is sent, so a failed commit
+        turns into a 500-error response. The transaction of a request that
+        ends with an error response is discarded and rolled back by
+        close_db().
+
+    Args:
+        response (Response): the response to be sent
+
+    Returns:
+        Response: the unchanged response
+    """
+    if response.status_code < 400:
+        commit_db()
+    else:
+        discard_db()
+    return response
+
+
+@app.after_request
+def check_query_budget(response):
+    """Logs the number of SQL statements executed for the request.
+
+        In debug mode, a request that exceeds its query budget fails with
+        an error so that N+1 query regressions are noticed early.
+
+    Args:
+        response (Response): the response to be sent
+
+    Raises:
+        RuntimeError: if the query budget of the route is exceeded in
+            debug mode
+
+    Returns:
+        Response: the unchanged response
+    """
+    count = get_query_count()
+    app.logger.debug("%s executed %d SQL statements", request.path, count)
+    budget = QUERY_BUDGETS.get(request.path)
+    if app.debug and budget is not None and count > budget:
+        raise RuntimeError(
+            f"{request.path} executed {count} SQL statements; the budget is {budget}."
+        )
+    return response
+
+
 @app.teardown_appcontext
 def close_connection(exception):
-    """Closes the database connection
+    """Ends the open database transaction and releases the connection
 
     Args:
-        exception (sqlite3.Error): The error raised if the close operation fails;
+        exception (Exception): The error that ended the request;
             Otherwise, None.
     """
-    close_db()
+    close_db(exception)
 
 
 @app.errorhandler(500)
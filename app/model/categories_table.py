@@ -1,11 +1,14 @@
-from flask import abort
 import sqlite3
-from model.database import get_db
+from model.database import get_db, sqlite_guard
+
+_SQL_GET_BY_ID = "SELECT CategoryID, CategoryName FROM CATEGORIES WHERE CategoryID = ?"
+_SQL_GET_BY_NAME = "SELECT CategoryID, CategoryName FROM CATEGORIES WHERE CategoryName = ?"
 
 
 class CategoriesTable:
 
     @staticmethod
+    @sqlite_guard
     def get():
         """Gets all rows from the categories table.
 
@@ -13,22 +16,17 @@ class CategoriesTable:
             aborted with the status code 500.
 
         Returns:
-            list: a list of all rows; each row is a dictionary that maps
+            list: a list of all rows; each row is a sqlite3.Row that maps
                 column names to values. An empty list is returned if the 
                 table has no columns.
         """
-        try:
-            db = get_db()
-            result = db.execute("SELECT * FROM CATEGORIES")
-            categories = result.fetchall()
-            categories = [dict(category) for category in categories]
-            return categories
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db()
+        result = db.execute("SELECT * FROM CATEGORIES")
+        return result.fetchall()
 
 
     @staticmethod
+    @sqlite_guard
     def get_by_id(category_id):
         """Gets the row with the specified id from the categories table
             
@@ -41,21 +39,18 @@ class CategoriesTable:
         dict: the catgory with the specified category id; None if no such
             category exists
         """
-        try:
-            db = get_db()
-            query = "SELECT * FROM CATEGORIES WHERE CategoryID = ?"
-            data = [category_id]
-            result = db.execute(query, data)
-            category = result.fetchone()
-            if category is not None:
-                category = dict(category)
-            return category
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db()
+        query = _SQL_GET_BY_ID
+        data = [category_id]
+        result = db.execute(query, data)
+        category = result.fetchone()
+        if category is not None:
+            category = dict(category)
+        return category
 
 
     @staticmethod
+    @sqlite_guard
     def get_by_name(category_name):
         """Gets the row with the given category name from the categories table.
             
@@ -69,21 +64,18 @@ class CategoriesTable:
             dict: the catgory with the specified name; None if no such 
                     catgory exists
         """
-        try:
-            db = get_db()
-            query = "SELECT * FROM CATEGORIES WHERE CategoryName = ?"
-            data = [category_name]
-            result = db.execute(query, data)
-            category = result.fetchone()
-            if category is not None:
-                category = dict(category)
-            return category
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db()
+        query = _SQL_GET_BY_NAME
+        data = [category_name]
+        result = db.execute(query, data)
+        category = result.fetchone()
+        if category is not None:
+            category = dict(category)
+        return category
 
 
     @staticmethod
+    @sqlite_guard
     def insert(category_data):
         """Inserts the specified category into the categories table.
 
@@ -101,31 +93,33 @@ class CategoriesTable:
                     True; an error message if success is False
                 category (dict): the inserted category; None if success is False
         """
+        category_name = category_data["category_name"]
+        success, message = CategoriesTable.validate_name(category_name)
+        if not success:
+            return False, message, None
+        #if "category_name" not in category_data:
+        #    return False, "Category name is missing.", None
+
+        # The uniqueness of the name is checked by the UNIQUE constraint
+        # of the CATEGORIES table
+        db = get_db(write=True)
+        query = """
+            INSERT INTO CATEGORIES (CategoryName) 
+            VALUES (?)
+            RETURNING CategoryID, CategoryName
+        """
+        data = [category_name]
         try:
-            category_name = category_data["category_name"]
-            success, message = CategoriesTable.validate_name(category_name)
-            if not success:
-                return False, message, None
-            #if "category_name" not in category_data:
-            #    return False, "Category name is missing.", None
-
-            db = get_db()
-            query = """
-                INSERT INTO CATEGORIES (CategoryName) 
-                VALUES (?)
-            """
-            data = [category_name]
-            db.execute(query, data)
-            category = CategoriesTable.get_by_name(category_name)
-            db.commit()
-            return True, "The category has been inserted.", category
-
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+            inserted = db.execute(query, data).fetchall()
+        except sqlite3.IntegrityError as error:
+            if "CategoryName" in str(error):
+                return False, "Category name exists already.", None
+            raise
+        return True, "The category has been inserted.", dict(inserted[0])
 
 
     @staticmethod
+    @sqlite_guard
     def delete(category_id):
         """Deletes the row with the specified id from the categories table.
 
@@ -139,35 +133,32 @@ class CategoriesTable:
             dict: the deleted category; None if there exists no category with 
                 the specified id
         """
-        try:
-            db = get_db()
-            category = CategoriesTable.get_by_id(category_id)
-            if category is None:
-                return None
-            
-            # This import statement has been placed inside the code
-            # to avoid a circular import
-            from model.products_table import ProductsTable
-            if ProductsTable.get_by_category_id(category_id):
-                return False, "The category cannot be deleted since it contains products.", None
-
-            query = "DELETE FROM CATEGORIES WHERE CategoryID = ?"
+        db = get_db(write=True)
+        query = """
+            DELETE FROM CATEGORIES
+            WHERE CategoryID = ?
+              AND NOT EXISTS (SELECT 1 FROM PRODUCTS WHERE CategoryID = ?)
+            RETURNING CategoryID, CategoryName
+        """
+        data = [category_id, category_id]
+        deleted = db.execute(query, data).fetchall()
+        if not deleted:
+            query = "SELECT EXISTS(SELECT 1 FROM CATEGORIES WHERE CategoryID = ?)"
             data = [category_id]
-            db.execute(query, data)
-            db.commit()
-            return True, "The category has been deleted.", category
+            if not db.execute(query, data).fetchone()[0]:
+                return None
+            return False, "The category cannot be deleted since it contains products.", None
 
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        category = dict(deleted[0])
+        return True, "The category has been deleted.", category
 
 
     @staticmethod
     def validate_name(name):
         """Checks if the specified name is a valid category name.
 
-            If the necessary database operations raise a sqlite3.Error, 
-            the method is aborted with the status code 500.
+            Whether the name exists already is checked by insert() through
+            the UNIQUE constraint of the categories table.
 
         Args:
             name (str): the category name to be validated
@@ -184,8 +175,4 @@ class CategoriesTable:
         if len(name) == 0:
             return False, "Category name cannot be empty."
 
-        category = CategoriesTable.get_by_name(name)
-        if category is not None:
-            return False, "Category name exists already."
-
         return True, "Category name is valid."
\ No newline at end of file
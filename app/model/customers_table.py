@@ -1,28 +1,46 @@
-from flask import abort
-import sqlite3
-from model.database import get_db
+from model.database import get_db, sqlite_guard
 
 
 class CustomersTable:
 
     @staticmethod
-    def get():
-        """Gets all rows from the customers table.
+    @sqlite_guard
+    def get(limit=50, after_last_name=None, after_id=None):
+        """Gets one page of rows from the customers table.
 
+            The rows are ordered by last name and customer id. A page starts
+            right after the customer given by after_last_name and after_id,
+            or right after all customers named after_last_name if after_id
+            is None.
             If the database operations raise a sqlite3.Error, the method is 
             aborted with the status code 500.
 
+        Args:
+            limit (int): the maximum number of rows to be returned
+            after_last_name (str): the last name of the last customer of the
+                previous page; None for the first page
+            after_id (int): the id of the last customer of the previous page;
+                None to skip every customer with after_last_name
+
         Returns:
-            list: a list of all rows; each row is a dictionary that maps
-                column names to values. An empty list is returned if the 
-                table has no columns.
+            list: a list of at most limit rows; each row is a sqlite3.Row that
+                maps column names to values. An empty list is returned if 
+                there are no more rows.
+        """
+        db = get_db()
+        if after_last_name is None:
+            condition, data = "1", []
+        elif after_id is None:
+            condition, data = "LastName > ?", [after_last_name]
+        else:
+            condition = "(LastName, CustomerID) > (?, ?)"
+            data = [after_last_name, after_id]
+        query = f"""
+            SELECT * FROM CUSTOMERS
+            WHERE {condition}
+            ORDER BY LastName, CustomerID
+            LIMIT ?
         """
-        try:
-            db = get_db()
-            result = db.execute("SELECT * FROM CUSTOMERS ORDER BY LastName")
-            customers = result.fetchall()
-            customers = [dict(customer) for customer in customers]
-            return customers
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        data.append(limit)
+        result = db.execute(query, data)
+        return result.fetchall()
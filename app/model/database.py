@@ -1,13 +1,87 @@
+import functools
+import queue
 import sqlite3
-from flask import g
+from flask import abort, current_app, g, has_app_context
 
 
 DATABASE = './app/database/bakery.db'
+POOL_SIZE = 8
+CACHED_STATEMENTS = 256
 
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-20000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+)
+
+# ProductCode and CategoryName are declared UNIQUE in the schema and are
+# therefore indexed by SQLite already.
+INDEXES = (
+    "CREATE INDEX IF NOT EXISTS idx_products_category ON PRODUCTS(CategoryID)",
+    "CREATE INDEX IF NOT EXISTS idx_customers_lastname ON CUSTOMERS(LastName)",
+)
+
+TRANSACTION_STATEMENTS = ("BEGIN", "COMMIT", "ROLLBACK")
+
+_pool = queue.LifoQueue(maxsize=POOL_SIZE)
+
+
+def _count_query(statement):
+    """Counts a statement executed during the current request.
+
+        Transaction control statements are not counted.
+
+    Args:
+        statement (str): the SQL statement that has been executed
+    """
+    if statement.startswith(TRANSACTION_STATEMENTS):
+        return
+    if has_app_context():
+        g._query_count = g.get("_query_count", 0) + 1
+
+
+def _connect():
+    """Opens and configures a new connection to the database.
+
+        Missing indexes are created on the way.
+
+    Raises:
+        sqlite3.Error: if the database connection cannot be established
+
+    Returns:
+        sqlite3.Connection: the configured database connection
+    """
+    db = sqlite3.connect(
+        DATABASE,
+        check_same_thread=False,
+        isolation_level=None,
+        cached_statements=CACHED_STATEMENTS,
+    )
+    db.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        db.execute(pragma)
+    for index in INDEXES:
+        db.execute(index)
+    db.set_trace_callback(_count_query)
+    return db
+
+
+def get_db(write=False):
+    """Checks a connection out of the connection pool.
+
+        A new connection is opened if the pool is empty. The connection
+        is kept in g for the rest of the request. Reads run in autocommit
+        mode; the first write access of a request starts an immediate
+        transaction that commit_db() commits once the response is ready,
+        or close_db() commits when an app context used outside a request
+        ends.
+
+    Args:
+        write (bool): True if the caller is going to write to the database
 
-def get_db():
-    """Opens a connection to the database.
-    
     Raises:
         sqlite3.Error: if the database connection cannot be established
 
@@ -16,18 +90,103 @@ def get_db():
     """
     db = getattr(g, "_database", None)
     if db is None:
-        db = g._database = sqlite3.connect(DATABASE)
-        db.row_factory = sqlite3.Row
+        try:
+            db = _pool.get_nowait()
+        except queue.Empty:
+            db = _connect()
+        g._database = db
+    if write and not db.in_transaction:
+        # An immediate transaction takes the write lock up front, so the
+        # reads that precede a write cannot see an outdated snapshot
+        db.execute("BEGIN IMMEDIATE")
     return db
 
 
-def close_db():
-    """Closes the connection to the database.
+def get_query_count():
+    """Gets the number of SQL statements executed during the current request.
+
+    Returns:
+        int: the number of executed statements
+    """
+    return g.get("_query_count", 0)
+
+
+def discard_db():
+    """Makes close_db() roll back the transaction of the current request."""
+    g._discard_transaction = True
+
+
+def close_db(exception=None):
+    """Ends the open transaction and releases the connection of the context.
+
+        Within a request, commit_db() has already committed the transaction
+        of a successful response, and a failed request is rolled back here.
+        Outside a request, e.g. in a script using an app context, the
+        transaction is committed unless the context ended with an exception
+        or discard_db() has been called. The connection is returned to the
+        pool, or closed if the pool is full or ending the transaction fails.
+
+    Args:
+        exception (Exception): the exception that ended the context; None
+            if there was none
 
     Raises:
-        sqlite3.Error: if the operation fails
+        sqlite3.Error: if the commit or the rollback fails
     """
-    db = getattr(g, "_database", None)
-    if db is not None:
+    discard = g.pop("_discard_transaction", False)
+    db = g.pop("_database", None)
+    if db is None:
+        return
+    try:
+        if db.in_transaction:
+            if exception is None and not discard:
+                db.commit()
+            else:
+                db.rollback()
+    except sqlite3.Error:
+        db.close()
+        raise
+    try:
+        _pool.put_nowait(db)
+    except queue.Full:
         db.close()
 
+
+def sqlite_guard(method):
+    """Turns a sqlite3.Error raised by a database method into a 500 error.
+
+        The error is logged with the app logger, the transaction of the
+        request is rolled back, and the request is aborted with the status
+        code 500.
+
+    Args:
+        method (function): the database method to be guarded
+
+    Returns:
+        function: the guarded method
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except sqlite3.Error:
+            current_app.logger.exception(
+                "Database operation %s failed", method.__qualname__
+            )
+            db = getattr(g, "_database", None)
+            if db is not None and db.in_transaction:
+                db.rollback()
+            abort(500)
+    return wrapper
+
+
+@sqlite_guard
+def commit_db():
+    """Commits the transaction of the current request, if there is one.
+
+        If the commit fails, the transaction is rolled back and the request
+        is aborted with the status code 500.
+    """
+    db = getattr(g, "_database", None)
+    if db is not None and db.in_transaction:
+        db.commit()
@@ -1,12 +1,23 @@
-from flask import abort
+import json
 import sqlite3
 import re
-from model.database import get_db
-from model.categories_table import CategoriesTable
+from model.database import get_db, sqlite_guard
+
+_SQL_COLUMNS = "ProductID, CategoryID, ProductCode, ProductName, Price"
+_SQL_GET_BY_CATEGORY_ID = f"SELECT {_SQL_COLUMNS} FROM PRODUCTS WHERE CategoryID = ?"
+_SQL_GET_BY_ID = f"SELECT {_SQL_COLUMNS} FROM PRODUCTS WHERE ProductID = ?"
+_SQL_GET_BY_CODE = f"SELECT {_SQL_COLUMNS} FROM PRODUCTS WHERE ProductCode = ?"
+_SQL_INSERT = """
+    INSERT INTO PRODUCTS (CategoryID, ProductCode, ProductName, Price)
+    VALUES (?, ?, ?, ?)
+"""
+
+_PRICE_RE = re.compile(r"^\d*\.\d\d$|^\d*$")
 
 
 class ProductsTable:
     @staticmethod
+    @sqlite_guard
     def get():
         """Gets all rows from the products .
 
@@ -14,20 +25,44 @@ class ProductsTable:
             aborted with the status code 500.
 
         Returns:
-            list: a list of all rows; each row is a dictionary that maps column
+            list: a list of all rows; each row is a sqlite3.Row that maps column
                 names to values. An empty list if the table has no rows.
         """
-        try:
-            db = get_db()
-            result = db.execute("SELECT * FROM PRODUCTS")
-            products = result.fetchall()
-            products = [dict(product) for product in products]
-            return products
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db()
+        result = db.execute("SELECT * FROM PRODUCTS")
+        return result.fetchall()
+
+    @staticmethod
+    @sqlite_guard
+    def get_json():
+        """Gets all rows from the products table as a JSON array.
+
+            The JSON text is built by SQLite, so no Python object is created
+            per row.
+            If the database operations raise a sqlite3.Error, the method is
+            aborted with the status code 500.
+
+        Returns:
+            str: a JSON array of all rows; each row is an object that maps
+                column names to values. "[]" if the table has no rows.
+        """
+        db = get_db()
+        result = db.execute(
+            """
+            SELECT json_group_array(json_object(
+                'ProductID', ProductID,
+                'CategoryID', CategoryID,
+                'ProductCode', ProductCode,
+                'ProductName', ProductName,
+                'Price', Price
+            ))
+            FROM PRODUCTS
+            """
+        )
+        return result.fetchone()[0]
 
     @staticmethod
+    @sqlite_guard
     def get_by_category_id(category_id):
         """Gets the rows with the given category id from the products table.
 
@@ -42,19 +77,16 @@ class ProductsTable:
                 is a dictionary that maps column names to values. An empty list
                 if there are not products with the specified category id.
         """
-        try:
-            db = get_db()
-            query = "SELECT * FROM PRODUCTS WHERE CategoryID = ?"
-            data = [category_id]
-            result = db.execute(query, data)
-            products = result.fetchall()
-            products = [dict(product) for product in products]
-            return products
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db()
+        query = _SQL_GET_BY_CATEGORY_ID
+        data = [category_id]
+        result = db.execute(query, data)
+        products = result.fetchall()
+        products = [dict(product) for product in products]
+        return products
 
     @staticmethod
+    @sqlite_guard
     def get_by_id(product_id):
         """Gets the row with the specified id from the products table.
 
@@ -68,20 +100,17 @@ class ProductsTable:
             dict: the product with the specified product id; None if no such
                 product exists
         """
-        try:
-            db = get_db()
-            query = "SELECT * FROM PRODUCTS WHERE ProductID = ?"
-            data = [product_id]
-            result = db.execute(query, data)
-            product = result.fetchone()
-            if product is not None:
-                product = dict(product)
-            return product
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db()
+        query = _SQL_GET_BY_ID
+        data = [product_id]
+        result = db.execute(query, data)
+        product = result.fetchone()
+        if product is not None:
+            product = dict(product)
+        return product
 
     @staticmethod
+    @sqlite_guard
     def get_by_code(product_code):
         """Gets the row with the given product code from the products table.
 
@@ -95,20 +124,17 @@ class ProductsTable:
             dict: the product with the specified product code, None if no
                 such product exists
         """
-        try:
-            db = get_db()
-            query = "SELECT * FROM PRODUCTS WHERE ProductCode = ?"
-            data = [product_code]
-            result = db.execute(query, data)
-            product = result.fetchone()
-            if product is not None:
-                product = dict(product)
-            return product
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db()
+        query = _SQL_GET_BY_CODE
+        data = [product_code]
+        result = db.execute(query, data)
+        product = result.fetchone()
+        if product is not None:
+            product = dict(product)
+        return product
 
     @staticmethod
+    @sqlite_guard
     def insert(product_data):
         """Inserts the specified product into the products table.
 
@@ -130,32 +156,96 @@ class ProductsTable:
                     True; an error message if success is False
                 category (dict): the inserted product; None if success is False
         """
-        try:
-            valid, message = ProductsTable.validate_data_for_insert(product_data)
-            if not valid:
-                return False, message, None
+        # The write transaction is started before the validation queries so
+        # that no other connection can commit in between
+        db = get_db(write=True)
+        valid, message = ProductsTable.validate_data_for_insert(product_data)
+        if not valid:
+            return False, message, None
+
+        data = [
+            product_data["category_id"],
+            product_data["product_code"],
+            product_data["product_name"],
+            product_data["price"],
+        ]
+        query = _SQL_INSERT + f"RETURNING {_SQL_COLUMNS}"
+        product = dict(db.execute(query, data).fetchall()[0])
+        return True, "The product has been inserted", product
 
-            db = get_db()
-            query = """
-                INSERT INTO PRODUCTS (CategoryID, ProductCode, ProductName, Price) 
-                VALUES (?, ?, ?, ?)
-            """
-            data = [
+    @staticmethod
+    @sqlite_guard
+    def insert_many(products_data):
+        """Inserts the specified products into the products table.
+
+            The products are validated with a fixed number of queries and
+            inserted in a single transaction. If one of the products is
+            invalid, no product is inserted.
+            If the database operations raise a sqlite3.Error, the method is
+            aborted with the status code 500.
+
+        Args:
+            products_data (list): the data of the products to be inserted;
+                each item must satisfy the requirements of insert()
+
+        Returns:
+            tuple: (success, message, count) where
+                success (bool): True if the products have been inserted
+                message (str): "The products have been inserted." if success
+                    is True; an error message if success is False
+                count (int): the number of inserted products; None if
+                    success is False
+        """
+        for index, product_data in enumerate(products_data):
+            valid, message = ProductsTable._validate_fields(product_data)
+            if not valid:
+                return False, f"Product {index + 1}: {message}", None
+
+        # The codes and category ids of the whole batch are checked with one
+        # query each; json_each avoids SQLite's limit on bound parameters
+        db = get_db(write=True)
+        codes = [product_data["product_code"] for product_data in products_data]
+        query = """
+            SELECT ProductCode FROM PRODUCTS
+            WHERE ProductCode IN (SELECT value FROM json_each(?))
+        """
+        existing_codes = {row[0] for row in db.execute(query, [json.dumps(codes)])}
+        category_ids = [product_data["category_id"] for product_data in products_data]
+        # The ids are compared by SQLite, as in _preflight(), so that e.g.
+        # 1.0 and "1" match the category id 1
+        query = """
+            SELECT key FROM json_each(?)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM CATEGORIES WHERE CategoryID = value
+            )
+        """
+        missing_category_indexes = {
+            row[0] for row in db.execute(query, [json.dumps(category_ids)])
+        }
+
+        seen_codes = set()
+        for index, product_data in enumerate(products_data):
+            code = product_data["product_code"]
+            if code in existing_codes or code in seen_codes:
+                return False, f"Product {index + 1}: Product code exists already.", None
+            seen_codes.add(code)
+            if index in missing_category_indexes:
+                return False, f"Product {index + 1}: Category ID does not exist.", None
+
+        data = [
+            [
                 product_data["category_id"],
                 product_data["product_code"],
                 product_data["product_name"],
                 product_data["price"],
             ]
-            db.execute(query, data)
-            product = ProductsTable.get_by_code(product_data["product_code"])
-            db.commit()
-            return True, "The product has been inserted", product
-
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+            for product_data in products_data
+        ]
+        db.executemany(_SQL_INSERT, data)
+        return True, "The products have been inserted.", len(data)
 
     @staticmethod
+    @sqlite_guard
     def update(product_id, product_data):
         """Updates the product data of the row with the specified product id.
 
@@ -177,39 +267,43 @@ class ProductsTable:
                     True; an error message if success is False
                 category (dict): the updated product; None if success is False
         """
+        valid, message = ProductsTable._validate_fields(product_data)
+        if not valid:
+            return False, message, None
+
+        # Product code uniqueness and the category id are checked by the
+        # UNIQUE and FOREIGN KEY constraints of the PRODUCTS table
+        db = get_db(write=True)
+        query = f"""
+            UPDATE PRODUCTS 
+            SET CategoryID = ?,
+                ProductCode = ?,
+                ProductName = ?,
+                Price = ? 
+            WHERE ProductID = ?
+            RETURNING {_SQL_COLUMNS}
+        """
+        data = [
+            product_data["category_id"],
+            product_data["product_code"],
+            product_data["product_name"],
+            product_data["price"],
+            product_id,
+        ]
         try:
-            valid, message = ProductsTable.validate_data_for_update(
-                product_id, product_data
-            )
-            if not valid:
-                return False, message, None
-
-            db = get_db()
-            query = """
-                UPDATE PRODUCTS 
-                SET CategoryID = ?,
-                    ProductCode = ?,
-                    ProductName = ?,
-                    Price = ? 
-                WHERE ProductID = ?
-            """
-            data = [
-                product_data["category_id"],
-                product_data["product_code"],
-                product_data["product_name"],
-                product_data["price"],
-                product_id,
-            ]
-            db.execute(query, data)
-            product = ProductsTable.get_by_code(product_data["product_code"])
-            db.commit()
-            return True, "The product has been updated.", product
-
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+            updated = db.execute(query, data).fetchall()
+        except sqlite3.IntegrityError as error:
+            if "ProductCode" in str(error):
+                return False, "Product code exists already.", None
+            if "FOREIGN KEY" in str(error):
+                return False, "Category ID does not exist.", None
+            raise
+        if not updated:
+            return False, "There is no product with the specified id.", None
+        return True, "The product has been updated.", dict(updated[0])
 
     @staticmethod
+    @sqlite_guard
     def delete(product_id):
         """Deletes the row with the given product id from the products table.
 
@@ -223,77 +317,41 @@ class ProductsTable:
             dict: the deleted product; None if there exists no product with
                 the specified id.
         """
-        try:
-            db = get_db()
-            product = ProductsTable.get_by_id(product_id)
-            if product is None:
-                return None
-            query = "DELETE FROM PRODUCTS WHERE ProductID = ?"
-            data = [product_id]
-            db.execute(query, data)
-            db.commit()
-            return product
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db(write=True)
+        query = f"DELETE FROM PRODUCTS WHERE ProductID = ? RETURNING {_SQL_COLUMNS}"
+        data = [product_id]
+        deleted = db.execute(query, data).fetchall()
+        if not deleted:
+            return None
+        return dict(deleted[0])
 
     @staticmethod
-    def validate_data_for_update(product_id, product_data):
-        """Checks if the specified product data is valid.
-
-            The specified data is the new data of the existing product with
-            with the specified product id.
-            If the necessary database operations raise a sqlite3.Error,
-            the method is aborted with the status code 500.
+    def _preflight(code, category_id):
+        """Looks up everything the product validation needs in one query.
 
         Args:
-            product_id (int): the id of the product to be updated
-            product (dict): the new product data
+            code (str): the product code to be validated
+            category_id (int): the category id to be validated
+
+        Raises:
+            sqlite3.Error: if the database operation fails
 
         Returns:
-            tuple: (valid, message) where
-                valid (bool): True if the product data is valid
-                message (str): "The product data is valid." if valid is
-                    True; an error message if valid is False
+            sqlite3.Row: a row with the columns
+                cat_ok: 1 if the category exists; None otherwise
+                code_owner: the id of the product that has the specified
+                    code; None if no product has that code
         """
-        try:
-            if ProductsTable.get_by_id(product_id) is None:
-                return False, "There is no product with the specified id."
-
-            valid, message = ProductsTable.validate_updated_code(
-                product_data["product_code"]
-                if "product_code" in product_data
-                else None,
-                product_id,
-            )
-            if not valid:
-                return False, message
-
-            valid, message = ProductsTable.validate_name(
-                product_data["product_name"] if "product_name" in product_data else None
-            )
-            if not valid:
-                return False, message
-
-            valid, message = ProductsTable.validate_category_id(
-                product_data["category_id"] if "category_id" in product_data else None
-            )
-            if not valid:
-                return False, message
-
-            valid, message = ProductsTable.validate_price(
-                product_data["price"] if "price" in product_data else None
-            )
-            if not valid:
-                return False, message
-
-            return True, "The product data is valid."
-
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
+        db = get_db()
+        query = """
+            SELECT (SELECT 1 FROM CATEGORIES WHERE CategoryID = ?) AS cat_ok,
+                   (SELECT ProductID FROM PRODUCTS WHERE ProductCode = ?) AS code_owner
+        """
+        data = [category_id, code]
+        return db.execute(query, data).fetchone()
 
     @staticmethod
+    @sqlite_guard
     def validate_data_for_insert(product_data):
         """Checks if the specified product data is valid.
 
@@ -310,167 +368,60 @@ class ProductsTable:
                 message (str): "The product data is valid." if valid is
                     True; an error message if valid is False
         """
-        try:
-            valid, message = ProductsTable.validate_code(
-                product_data["product_code"] if "product_code" in product_data else None
-            )
-            if not valid:
-                return False, message
-
-            valid, message = ProductsTable.validate_name(
-                product_data["product_name"] if "product_name" in product_data else None
-            )
-            if not valid:
-                return False, message
-
-            valid, message = ProductsTable.validate_category_id(
-                product_data["category_id"] if "category_id" in product_data else None
-            )
-            if not valid:
-                return False, message
-
-            valid, message = ProductsTable.validate_price(
-                product_data["price"] if "price" in product_data else None
-            )
-            if not valid:
-                return False, message
-
-            return True, "The product data is valid."
-
-        except sqlite3.Error as error:
-            print("ERROR: " + str(error))
-            abort(500)
-
-    @staticmethod
-    def validate_code(code):
-        """Checks if the specified code is a valid product code.
-
-            If the necessary database operations raise a sqlite3.Error,
-            the method is aborted with the status code 500.
-
-        Args:
-            code (str): the product code of a new product to be validated
-
-        Returns:
-            tuple: (valid, message) where
-                valid (bool): True if the product code is valid
-                message (str): "Product code is valid." if valid is
-                    True; an error message if valid is False
-        """
-        if code is None:
-            return False, "Missing product code."
-
-        if len(code) == 0:
-            return False, "Product code cannot be empty."
-
-        if ProductsTable.get_by_code(code) is not None:
+        valid, message = ProductsTable._validate_fields(product_data)
+        if not valid:
+            return False, message
+
+        preflight = ProductsTable._preflight(
+            product_data["product_code"], product_data["category_id"]
+        )
+        if preflight["code_owner"] is not None:
             return False, "Product code exists already."
+        if preflight["cat_ok"] is None:
+            return False, "Category ID does not exist."
 
-        return True, "Product code is valid."
+        return True, "The product data is valid."
 
     @staticmethod
-    def validate_updated_code(code, product_id):
-        """Checks if the given code is valid for the product with the given id.
+    def _validate_fields(product_data):
+        """Checks the product data that can be validated without a query.
 
-            If the necessary database operations raise a sqlite3.Error,
-            the method is aborted with the status code 500.
+            The fields are checked in the order code, name, category id and
+            price.
 
         Args:
-            code (str): the product code of an existing product to be validated
-            product_id (int): the id of the product to be updated
+            product (dict): the product data to be validated
 
         Returns:
             tuple: (valid, message) where
-                valid (bool): True if the product code is valid
-                message (str): "Product code is valid." if valid is
+                valid (bool): True if the product data is valid
+                message (str): "The product data is valid." if valid is
                     True; an error message if valid is False
         """
+        code = product_data.get("product_code")
         if code is None:
             return False, "Missing product code."
-
         if len(code) == 0:
             return False, "Product code cannot be empty."
 
-        tmp_product = ProductsTable.get_by_code(code)
-        if tmp_product is not None and tmp_product["ProductID"] is not int(product_id):
-            return False, "Product code exists already."
-
-        return True, "Product code is valid."
-
-    @staticmethod
-    def validate_name(name):
-        """Checks if the specified name is a valid product name.
-
-            If the necessary database operations raise a sqlite3.Error,
-            the method is aborted with the status code 500.
-
-        Args:
-            name (str): the product name to be validated
-
-        Returns:
-            tuple: (valid, message) where
-                valid (bool): True if the product name is valid
-                message (str): "Product name is valid." if valid is
-                    True; an error message if valid is False
-        """
+        name = product_data.get("product_name")
         if name is None:
             return False, "Missing product name."
-
         if len(name) == 0:
             return False, "Product name cannot be empty."
-        elif len(name) < 3:
-            return False, "Product name must have at least characters."
-
-        return True, "Product name is valid."
-
-    @staticmethod
-    def validate_category_id(category_id):
-        """Checks if the specified id is the id of an existing category.
+        if len(name) < 3:
+            return False, "Product name must have at least 3 characters."
 
-            If the necessary database operations raise a sqlite3.Error,
-            the method is aborted with the status code 500.
-
-        Args:
-            category_id (int): the category id to be validated
-
-        Returns:
-            tuple: (valid, message) where
-                valid (bool): True if the category id exists
-                message (str): "Product name is valid." if valid is
-                    True; an error message if valid is False
-        """
-        if category_id is None:
+        if product_data.get("category_id") is None:
             return False, "Missing category id."
 
-        category = CategoriesTable.get_by_id(category_id)
-        if category is None:
-            return False, "Category ID does not exist."
-
-        return True, "Category id is valid."
-
-    @staticmethod
-    def validate_price(price):
-        """Checks if the specified price represents a valid price.
-
-            If the necessary database operations raise a sqlite3.Error,
-            the method is aborted with the status code 500.
-
-        Args:
-            price (float): the price to be validated
-
-        Returns:
-            tuple: (valid, message, price) where
-                valid (bool): True if the price is valid
-                message (str): "Product name is valid." if valid is
-                    True; an error message if valid is False
-        """
+        price = product_data.get("price")
         if price is None:
             return False, "Missing price."
-
         if price < 0:
             return False, "Price must be a nonnegative value."
 
-        return True, "Price is valid."
+        return True, "The product data is valid."
 
     @staticmethod
     def validate_price_string(price):
@@ -494,7 +445,7 @@ class ProductsTable:
         if len(price) == 0:
             return False, "Price cannot be empty."
 
-        if re.search("^\d*[.]\d\d$|^\d*$", price) is None:
+        if _PRICE_RE.match(price) is None:
             return False, "Price must be a nonnegative value with two decimal places."
 
         return True, "Price is valid."
@@ -0,0 +1,33 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+APP_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "app")
+sys.path.insert(0, APP_DIR)
+
+import model.database as database  # noqa: E402
+
+
+def _drain_pool():
+    while not database._pool.empty():
+        database._pool.get_nowait().close()
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """Points the app at a scratch copy of the bakery database."""
+    path = tmp_path / "bakery.db"
+    shutil.copy(os.path.join(APP_DIR, "database", "bakery.db"), path)
+    _drain_pool()
+    monkeypatch.setattr(database, "DATABASE", str(path))
+    yield path
+    _drain_pool()
+
+
+@pytest.fixture
+def app(db_path):
+    from app import app
+
+    return app
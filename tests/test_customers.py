@@ -0,0 +1,32 @@
+from model.customers_table import CustomersTable
+
+
+def test_after_last_name_only_skips_that_name(app):
+    with app.app_context():
+        customers = CustomersTable.get(3, "Davis")
+    assert customers
+    assert all(customer["LastName"] > "Davis" for customer in customers)
+
+
+def test_pages_cover_all_customers_once(app):
+    with app.app_context():
+        everyone = [customer["CustomerID"] for customer in CustomersTable.get(1000)]
+        paged = []
+        after_last_name = after_id = None
+        while True:
+            page = CustomersTable.get(3, after_last_name, after_id)
+            if not page:
+                break
+            paged += [customer["CustomerID"] for customer in page]
+            after_last_name, after_id = page[-1]["LastName"], page[-1]["CustomerID"]
+    assert paged == everyone
+
+
+def test_full_last_page_has_no_next_link(app):
+    with app.app_context():
+        count = len(CustomersTable.get(1000))
+    client = app.test_client()
+    response = client.get(f"/customer?limit={count}")
+    assert b"Next Customers" not in response.data
+    response = client.get(f"/customer?limit={count - 1}")
+    assert b"Next Customers" in response.data
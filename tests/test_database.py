@@ -0,0 +1,54 @@
+import pytest
+
+from model.categories_table import CategoriesTable
+from model.products_table import ProductsTable
+
+NEW_PRODUCT = {
+    "category_id": 1,
+    "product_code": "testA",
+    "product_name": "Test Loaf",
+    "price": 2.5,
+}
+
+
+def test_insert_in_app_context_persists(app):
+    with app.app_context():
+        success, _, product = ProductsTable.insert(NEW_PRODUCT)
+    assert success
+
+    with app.app_context():
+        stored = ProductsTable.get_by_code("testA")
+    assert stored == product
+
+
+def test_insert_many_in_test_request_context_persists(app):
+    second = dict(NEW_PRODUCT, product_code="testB")
+    with app.test_request_context():
+        success, _, count = ProductsTable.insert_many([NEW_PRODUCT, second])
+    assert success and count == 2
+
+    with app.app_context():
+        assert ProductsTable.get_by_code("testA") is not None
+        assert ProductsTable.get_by_code("testB") is not None
+
+
+def test_app_context_ending_with_exception_rolls_back(app):
+    with pytest.raises(ValueError):
+        with app.app_context():
+            CategoriesTable.insert({"category_name": "Partial"})
+            raise ValueError
+
+    with app.app_context():
+        assert CategoriesTable.get_by_name("Partial") is None
+
+
+def test_list_pages_render(app):
+    client = app.test_client()
+    for path in ("/product", "/category", "/customer", "/product.json"):
+        assert client.get(path).status_code == 200
+
+
+def test_insert_returns_stored_row(app):
+    with app.app_context():
+        _, _, product = ProductsTable.insert(dict(NEW_PRODUCT, category_id="01"))
+    assert product["CategoryID"] == 1